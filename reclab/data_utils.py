@@ -11,8 +11,11 @@ import scipy.sparse
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), '../data')
 
+# The layout of the rating arrays optionally returned alongside the rating dicts.
+RATINGS_DTYPE = np.dtype([('u', 'i4'), ('i', 'i4'), ('score', 'f4')])
 
-def read_dataset(name, shuffle=True, seed=0):
+
+def read_dataset(name, shuffle=True, seed=0, return_array=False):
     """Read a dataset as specified by name.
 
     Parameters
@@ -23,6 +26,9 @@ def read_dataset(name, shuffle=True, seed=0):
     shuffle : bool, optional
         A flag to indicate whether the dataset should be shuffled after loading,
         true by default.
+    return_array : bool, optional
+        A flag to indicate whether the ratings should also be returned as a structured array,
+        false by default.
 
     Returns
     -------
@@ -34,13 +40,16 @@ def read_dataset(name, shuffle=True, seed=0):
         The dict of all ratings where the key is a tuple whose first element is the user-id
         and whose second element is the item id. The value is a tuple whose first element is the
         rating value and whose second element is the rating context (in this case an empty array).
+    ratings_arr : np.ndarray
+        Only returned if return_array is true. The same ratings as a structured array with
+        fields 'u', 'i' and 'score', where ratings_arr[k] is the k-th rating in ratings.
 
     """
     data = get_data(name)
 
-    return dataset_from_dataframe(data, shuffle=shuffle, seed=seed)
+    return dataset_from_dataframe(data, shuffle=shuffle, seed=seed, return_array=return_array)
 
-def dataset_from_dataframe(data, shuffle=True, seed=0):
+def dataset_from_dataframe(data, shuffle=True, seed=0, return_array=False):
     """Read a dataset as specified by name.
 
     Parameters
@@ -50,6 +59,9 @@ def dataset_from_dataframe(data, shuffle=True, seed=0):
     shuffle : bool, optional
         A flag to indicate whether the dataset should be shuffled after loading,
         true by default.
+    return_array : bool, optional
+        A flag to indicate whether the ratings should also be returned as a structured array,
+        false by default.
 
     Returns
     -------
@@ -61,6 +73,9 @@ def dataset_from_dataframe(data, shuffle=True, seed=0):
         The dict of all ratings where the key is a tuple whose first element is the user-id
         and whose second element is the item id. The value is a tuple whose first element is the
         rating value and whose second element is the rating context (in this case an empty array).
+    ratings_arr : np.ndarray
+        Only returned if return_array is true. The same ratings as a structured array with
+        fields 'u', 'i' and 'score', where ratings_arr[k] is the k-th rating in ratings.
 
     """
 
@@ -76,6 +91,17 @@ def dataset_from_dataframe(data, shuffle=True, seed=0):
         # TODO: may want to eventually a rating context depending on dataset (e.g. time)
         ratings[user_id, item_id] = (rating, np.zeros(0))
 
+    if return_array:
+        ratings_arr = np.empty(len(ratings), dtype=RATINGS_DTYPE)
+        if len(ratings) == len(data):
+            # Every row is a distinct rating so the columns line up with the dict already.
+            ratings_arr['u'] = data['user_id']
+            ratings_arr['i'] = data['item_id']
+            ratings_arr['score'] = data['rating']
+        else:
+            ratings_arr['u'], ratings_arr['i'], ratings_arr['score'] = ratings_to_soa(ratings)
+        return users, items, ratings, ratings_arr
+
     return users, items, ratings
 
 
@@ -113,7 +139,7 @@ def read_bandit_dataset(name):
     return features, ratings
 
 
-def split_ratings(ratings, proportion, shuffle=False, seed=None):
+def split_ratings(ratings, proportion, shuffle=False, seed=None, rng=None):
     """Split a group of ratings into two groups.
 
     Parameters
@@ -124,6 +150,12 @@ def split_ratings(ratings, proportion, shuffle=False, seed=None):
         The proportion of ratings that will be in the first group. Must be between 0 and 1.
     shuffle : bool
         Whether to shuffle the rating data.
+    seed : int, optional
+        The seed used to reseed the global numpy random state before shuffling.
+        Ignored if rng is given.
+    rng : np.random.Generator, optional
+        The generator used to shuffle the rating data. If given the global random state is left
+        untouched.
 
     Returns
     -------
@@ -139,9 +171,12 @@ def split_ratings(ratings, proportion, shuffle=False, seed=None):
     iterator = list(ratings.items())
 
     if shuffle:
-        if seed is not None:
-            np.random.seed(seed)
-        np.random.shuffle(iterator)
+        if rng is not None:
+            rng.shuffle(iterator)
+        else:
+            if seed is not None:
+                np.random.seed(seed)
+            np.random.shuffle(iterator)
 
     for i, (key, val) in enumerate(iterator):
         if i < split_1_end:
@@ -152,6 +187,64 @@ def split_ratings(ratings, proportion, shuffle=False, seed=None):
     return split_1, split_2
 
 
+def split_ratings_by_indices(ratings, indices, proportion):
+    """Split a group of ratings into two groups following a precomputed order.
+
+    This is equivalent to shuffling with split_ratings, but the order can be computed once and
+    reused across splits of the same ratings.
+
+    Parameters
+    ----------
+    ratings : dict
+        The ratings to split.
+    indices : np.ndarray of int
+        A permutation of the positions of the ratings in the dict, giving the order in which
+        ratings are assigned to the two groups.
+    proportion : float
+        The proportion of ratings that will be in the first group. Must be between 0 and 1.
+
+    Returns
+    -------
+    ratings_1 : OrderedDict
+        The first set of ratings.
+    ratings_2 : OrderedDict
+        The second set of ratings.
+
+    """
+    items = list(ratings.items())
+    split_1_end = int(proportion * len(ratings))
+    split_1 = collections.OrderedDict(items[i] for i in indices[:split_1_end])
+    split_2 = collections.OrderedDict(items[i] for i in indices[split_1_end:])
+    return split_1, split_2
+
+
+def ratings_to_soa(ratings):
+    """Convert a dict of ratings into separate arrays of user ids, item ids and rating values.
+
+    Parameters
+    ----------
+    ratings : dict
+        The ratings where the key is a tuple of the user id and item id and the value is a
+        tuple of the rating value and rating context.
+
+    Returns
+    -------
+    users : np.ndarray of int32
+        The user ids where users[i] is the user who made the i-th rating.
+    items : np.ndarray of int32
+        The item ids where items[i] is the item rated by the i-th rating.
+    scores : np.ndarray of float32
+        The rating values where scores[i] is the value of the i-th rating.
+
+    """
+    num_ratings = len(ratings)
+    users = np.fromiter((key[0] for key in ratings), dtype=np.int32, count=num_ratings)
+    items = np.fromiter((key[1] for key in ratings), dtype=np.int32, count=num_ratings)
+    scores = np.fromiter((val[0] for val in ratings.values()), dtype=np.float32,
+                         count=num_ratings)
+    return users, items, scores
+
+
 def read_zipped_csv(zipped_dir_name, data_name, data_url, csv_params):
     """Locate or download zipped file and load csv into DataFrame.
 
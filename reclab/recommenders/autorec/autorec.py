@@ -1,8 +1,8 @@
 """Pytorch implementation of AutoRec recommender."""
 
-import math
 import numpy as np
 import torch
+import torch.utils.data
 
 from .autorec_lib import autorec
 from .. import recommender
@@ -37,6 +37,9 @@ class Autorec(recommender.PredictRecommender):
         Probability to initialize dropout layer. Set to 0 for no dropout.
     random_seed : int
         Random seed to reproduce results.
+    compile_model : bool
+        Set to true to fuse the model's operations with torch.compile during training.
+        Requires torch 2.0 or later.
 
     """
 
@@ -44,7 +47,7 @@ class Autorec(recommender.PredictRecommender):
                  hidden_neuron=500, lambda_value=1,
                  train_epoch=1000, batch_size=1000, optimizer_method='RMSProp',
                  grad_clip=False, base_lr=1e-3, lr_decay=1e-2,
-                 dropout=0.05, random_seed=0):
+                 dropout=0.05, random_seed=0, compile_model=False):
         """Create new Autorec recommender."""
         super().__init__()
 
@@ -55,8 +58,8 @@ class Autorec(recommender.PredictRecommender):
 
         self.model = autorec.AutoRec(num_users,
                                      num_items,
-                                     seen_users=set(),
-                                     seen_items=set(),
+                                     seen_users=np.zeros(num_users, dtype=bool),
+                                     seen_items=np.zeros(num_items, dtype=bool),
                                      hidden_neuron=hidden_neuron,
                                      dropout=dropout,
                                      random_seed=random_seed)
@@ -65,10 +68,10 @@ class Autorec(recommender.PredictRecommender):
         self.num_items = num_items
         self.train_epoch = train_epoch
         self.batch_size = batch_size
-        self.num_batch = int(math.ceil(self.num_items / float(self.batch_size)))
         self.base_lr = base_lr
         self.optimizer_method = optimizer_method
         self.random_seed = random_seed
+        self.compile_model = compile_model
 
         self.lr_decay = lr_decay
         self.grad_clip = grad_clip
@@ -89,22 +92,31 @@ class Autorec(recommender.PredictRecommender):
 
         scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=100, gamma=self.lr_decay)
 
+        # Only densify the rows of each batch. Pinned host memory lets the batch copies
+        # to the GPU overlap with training.
+        loader = torch.utils.data.DataLoader(
+            range(data.shape[0]),
+            batch_size=self.batch_size,
+            shuffle=True,
+            collate_fn=lambda batch_idx: torch.from_numpy(data[batch_idx].toarray()),
+            pin_memory=self.device.type == 'cuda')
+
         self.model.to(self.device)
+        forward = self.model.forward
+        if self.compile_model:
+            # The model is rebuilt on every update so it also needs to be recompiled.
+            forward = torch.compile(self.model, mode='reduce-overhead')
         for epoch in range(self.train_epoch):
-            self.train(data, optimizer, scheduler)
+            self.train(loader, optimizer, forward)
+            scheduler.step()
 
-    def train(self, data, optimizer, scheduler):
+    def train(self, loader, optimizer, forward):
         """Train for a single epoch."""
-        random_perm_doc_idx = np.random.permutation(self.num_items)
-        for i in range(self.num_batch):
-            if i == self.num_batch - 1:
-                batch_set_idx = random_perm_doc_idx[i * self.batch_size:]
-            elif i < self.num_batch - 1:
-                batch_set_idx = random_perm_doc_idx[i * self.batch_size:(i+1) * self.batch_size]
-
-            batch = data[batch_set_idx, :].to(self.device)
-            output = self.model.forward(batch)
-            mask = self.mask_ratings[batch_set_idx, :].to(self.device)
+        for batch in loader:
+            batch = batch.to(self.device, non_blocking=True)
+            mask = batch.clamp(0, 1)
+            optimizer.zero_grad()
+            output = forward(batch)
             loss = self.model.loss(output,
                                    batch,
                                    mask,
@@ -115,7 +127,6 @@ class Autorec(recommender.PredictRecommender):
                 torch.nn.utils.clip_grad_norm_(self.model.parameters(), 5)
 
             optimizer.step()
-            scheduler.step()
 
     @property
     def name(self):  # noqa: D102
@@ -123,7 +134,10 @@ class Autorec(recommender.PredictRecommender):
 
     def _predict(self, user_item):
         self.model = self.model.eval()
-        return self.model.predict(user_item, self.ratings.to(self.device))
+        user_ids, item_ids, _ = recommender.unzip_user_item(user_item)
+        # pylint: disable=no-member
+        ratings = torch.from_numpy(self.ratings.toarray()).to(self.device)
+        return self.model.predict(user_ids, item_ids, ratings)
 
     def reset(self, users=None, items=None, ratings=None):  # noqa: D102
         self.model.prepare_model()
@@ -133,15 +147,17 @@ class Autorec(recommender.PredictRecommender):
         super().update(users, items, ratings)
         self.model.prepare_model()
         self.model = self.model.train()
-        for user_item in ratings:
-            self.model.seen_users.add(user_item[0])
-            self.model.seen_items.add(user_item[1])
-
-        ratings = self._ratings.toarray()
-        # Item-based autorec expects rows that represent items
-        # pylint: disable=no-member
-        self.ratings = torch.FloatTensor(ratings.T)
-        # pylint: disable=no-member
-        self.mask_ratings = torch.FloatTensor(ratings.T).clamp(0, 1)
+        if ratings is not None:
+            user_ids = np.fromiter((self._outer_to_inner_uid[user_id] for user_id, _ in ratings),
+                                   dtype=int, count=len(ratings))
+            item_ids = np.fromiter((self._outer_to_inner_iid[item_id] for _, item_id in ratings),
+                                   dtype=int, count=len(ratings))
+            self.model.seen_users[user_ids] = True
+            self.model.seen_items[item_ids] = True
+
+        # Item-based autorec expects rows that represent items. The ratings are kept sparse
+        # and only densified one batch at a time during training. Transposing a CSC matrix
+        # gives a CSR view of the same buffers, so we avoid building the transpose separately.
+        self.ratings = self._ratings.tocsc().astype(np.float32).T
 
         self.train_model(self.ratings)
@@ -1,3 +1,4 @@
+import numpy as np
 import torch
 
 class AutoRec(torch.nn.Module):
@@ -34,18 +35,11 @@ class AutoRec(torch.nn.Module):
         x = self.decoder(x)
         return x
 
-    def predict(self, user_item, test_data):
-        users = [triple[0] for triple in user_item]
-        items = [triple[1] for triple in user_item]
-
-        user_item = zip(users, items)
-        user_idx = set(users)
-        item_idx = set(items)
-        Estimated_R = self.forward(test_data)
-        for item in range(test_data.shape[0]):
-            for user in range(test_data.shape[1]):
-                if user not in self.seen_users and item not in self.seen_items:
-                    Estimated_R[item, user] = 3
-        idx = [tuple(users), tuple(items)]
-        Estimated_R = Estimated_R.clamp(1, 5)
-        return Estimated_R.T[idx].cpu().detach().numpy()
+    def predict(self, users, items, test_data):
+        # Reconstruct every item once and only gather the requested user-item pairs.
+        with torch.no_grad():
+            Estimated_R = self.forward(test_data)
+            Estimated_R = Estimated_R[torch.from_numpy(items), torch.from_numpy(users)]
+        Estimated_R = Estimated_R.clamp(1, 5).cpu().numpy()
+        Estimated_R[~self.seen_users[users] & ~self.seen_items[items]] = 3
+        return Estimated_R
@@ -39,10 +39,8 @@ class RandomRec(recommender.PredictRecommender):
     def _predict(self, user_item):  # noqa: D102
         # Random predictions for all pairs.
         all_predictions = self.dense_predictions
-        predictions = []
-        for user_id, item_id, _ in user_item:
-            predictions.append(all_predictions[user_id, item_id])
-        return np.array(predictions)
+        user_ids, item_ids, _ = recommender.unzip_user_item(user_item)
+        return all_predictions[user_ids, item_ids]
 
 
 class PerfectRec(recommender.PredictRecommender):
@@ -73,7 +71,5 @@ class PerfectRec(recommender.PredictRecommender):
     def _predict(self, user_item):  # noqa: D102
         # Use provided function to predict for all pairs.
         all_predictions = self.dense_predictions
-        predictions = []
-        for user_id, item_id, _ in user_item:
-            predictions.append(all_predictions[user_id, item_id])
-        return np.array(predictions)
+        user_ids, item_ids, _ = recommender.unzip_user_item(user_item)
+        return all_predictions[user_ids, item_ids]
@@ -1,12 +1,13 @@
 """The implementation for a neighborhood based recommender."""
-import heapq
-
 import numpy as np
 import scipy.sparse
-import scipy.sparse.linalg
 
 from . import recommender
 
+# The fraction of nonzero features above which a dense matrix product is faster than a sparse
+# one when computing self-similarities. This was measured on matrices of ml-100k's shape.
+DENSE_PRODUCT_MIN_DENSITY = 0.03
+
 
 class KNNRecommender(recommender.PredictRecommender):
     """A neighborhood based collaborative filtering algorithm.
@@ -41,8 +42,8 @@ class KNNRecommender(recommender.PredictRecommender):
         self._use_means = use_means
         self._feature_matrix = scipy.sparse.csr_matrix((0, 0))
         self._means = np.empty(0)
-        self._similarity_matrix = np.empty((0, 0))
-        self._ratings_matrix = np.empty((0, 0))
+        self._norms = np.empty(0)
+        self._similarity_matrix = np.empty((0, 0), dtype=np.float32)
         self._hyperparameters.update(locals())
 
         # We only want the function arguments so remove class related objects.
@@ -58,44 +59,39 @@ class KNNRecommender(recommender.PredictRecommender):
         if self._dense_predictions is not None:
             return self._dense_predictions
 
-        # Set up whether we will loop over users or items.
+        # The leading columns of the feature matrix hold the ratings made by (or given to) each
+        # row, so we can predict every pair at once by weighting them with sparse matrices
+        # whose rows select each row's neighborhood.
+        num_rows = self._similarity_matrix.shape[0]
         if self._user_based:
-            loop_range = range(len(self._users))
-            ratings_matrix = self._ratings_matrix
+            num_cols = len(self._items)
         else:
-            loop_range = range(len(self._items))
-            ratings_matrix = self._ratings_matrix.T
-
-        preds = []
-        for idx in loop_range:
-            relevant_idxs = nlargest_indices(
-                self._neighborhood_size, self._similarity_matrix[idx])
-            ratings = ratings_matrix[relevant_idxs]
-            # We only care about means and similarities with corresponding nonzero ratings.
-            zero = ratings == 0
-
-            # Create a matrix of means that can easily be subtracted by the ratings.
-            relevant_means = self._means[relevant_idxs]
-            relevant_means = np.tile(relevant_means, (ratings_matrix.shape[1], 1)).T
-            relevant_means[zero] = 0.0
-
-            # Create a matrix of relevant similarities that can easily be multiplied with ratings.
-            similarities = self._similarity_matrix[relevant_idxs, idx]
-            similarities = np.tile(similarities, (ratings_matrix.shape[1], 1)).T
-            similarities[zero] = 0.0
-
-            # Ensure that we aren't weighting by all 0.
-            zero = np.all(np.isclose(similarities, 0), axis=0)
-            similarities[:, zero] = 1.0
-
-            # Compute the predictions.
-            if self._use_means:
-                ratings_sum = self._means[idx] + (ratings - relevant_means)
-            else:
-                ratings_sum = ratings
-            preds.append((ratings_sum * similarities).sum(axis=0) / similarities.sum(axis=0))
+            num_cols = len(self._users)
+        relevant_idxs, similarities = self._neighborhoods(np.arange(num_rows))
+        # Make numerically zero similarities exactly zero so we can detect pairs where all the
+        # neighbors that made a rating have zero similarity.
+        similarities = np.where(np.isclose(similarities, 0), 0.0, similarities)
+        indptr = relevant_idxs.shape[1] * np.arange(num_rows + 1)
+        weights = scipy.sparse.csr_matrix(
+            (similarities.ravel(), relevant_idxs.ravel(), indptr), shape=(num_rows, num_rows))
+        uniform_weights = scipy.sparse.csr_matrix(
+            (np.ones(relevant_idxs.size), relevant_idxs.ravel(), indptr),
+            shape=(num_rows, num_rows))
+
+        ratings = self._feature_matrix[:, :num_cols]
+        rated = (ratings != 0).astype(np.float64)
+        if self._use_means:
+            ratings = ratings - scipy.sparse.diags(self._means) @ rated
+        preds = divide_zero((weights @ ratings).toarray(), (weights @ rated).toarray())
+
+        # Ensure that we aren't weighting by all 0.
+        all_zero = (abs(weights) @ rated).toarray() == 0
+        uniform_preds = divide_zero((uniform_weights @ ratings).toarray(),
+                                    (uniform_weights @ rated).toarray())
+        preds[all_zero] = uniform_preds[all_zero]
+        if self._use_means:
+            preds += self._means[:, np.newaxis]
 
-        preds = np.array(preds)
         if not self._user_based:
             preds = preds.T
 
@@ -104,12 +100,13 @@ class KNNRecommender(recommender.PredictRecommender):
 
     def reset(self, users=None, items=None, ratings=None):  # noqa: D102
         self._feature_matrix = scipy.sparse.csr_matrix((0, 0))
-        self._similarity_matrix = np.empty((0, 0))
+        self._similarity_matrix = np.empty((0, 0), dtype=np.float32)
         self._means = np.empty(0)
-        self._ratings_matrix = np.empty((0, 0))
+        self._norms = np.empty(0)
         super().reset(users, items, ratings)
 
     def update(self, users=None, items=None, ratings=None):  # noqa: D102
+        num_old = self._similarity_matrix.shape[0]
         super().update(users, items, ratings)
         if self._user_based:
             self._feature_matrix = scipy.sparse.csr_matrix(self._ratings)
@@ -119,99 +116,207 @@ class KNNRecommender(recommender.PredictRecommender):
                                   self._feature_matrix.getnnz(axis=1))
         if self._use_content:
             if self._user_based:
-                self._feature_matrix = scipy.sparse.hstack([self._feature_matrix, self._users])
+                self._feature_matrix = scipy.sparse.hstack([self._feature_matrix, self._users],
+                                                           format='csr')
             else:
-                self._feature_matrix = scipy.sparse.hstack([self._feature_matrix, self._items])
-        self._similarity_matrix = cosine_similarity(self._feature_matrix, self._feature_matrix,
-                                                    self._shrinkage)
-        np.fill_diagonal(self._similarity_matrix, 0)
-        # TODO: this may not be the best way to store ratings, but it does speed access
-        self._ratings_matrix = self._ratings.A
+                self._feature_matrix = scipy.sparse.hstack([self._feature_matrix, self._items],
+                                                           format='csr')
+
+        # Only the similarities involving rows whose features changed need to be recomputed.
+        num_rows = self._feature_matrix.shape[0]
+        dirty_rows = self._dirty_rows(users, items, ratings, num_old)
+        if num_old == 0 or 2 * len(dirty_rows) > num_rows:
+            self._norms = row_norms(self._feature_matrix)
+            self._similarity_matrix = cosine_similarity(self._feature_matrix,
+                                                        self._feature_matrix,
+                                                        self._shrinkage, self._norms, self._norms)
+            np.fill_diagonal(self._similarity_matrix, 0)
+        elif len(dirty_rows) > 0:
+            dirty_features = self._feature_matrix[dirty_rows]
+            norms = np.empty(num_rows)
+            norms[:num_old] = self._norms
+            norms[dirty_rows] = row_norms(dirty_features)
+            self._norms = norms
+            if num_rows > num_old:
+                similarity_matrix = np.zeros((num_rows, num_rows), dtype=np.float32)
+                similarity_matrix[:num_old, :num_old] = self._similarity_matrix
+                self._similarity_matrix = similarity_matrix
+            block = cosine_similarity(dirty_features, self._feature_matrix, self._shrinkage,
+                                      norms[dirty_rows], norms)
+            self._similarity_matrix[dirty_rows, :] = block
+            self._similarity_matrix[:, dirty_rows] = block.T
+            self._similarity_matrix[dirty_rows, dirty_rows] = 0
+
+    def _dirty_rows(self, users, items, ratings, num_old):
+        """Compute the inner ids of the rows of the feature matrix changed by an update.
+
+        Parameters
+        ----------
+        users : dict or None
+            The users passed to the update.
+        items : dict or None
+            The items passed to the update.
+        ratings : dict or None
+            The ratings passed to the update.
+        num_old : int
+            The number of rows in the similarity matrix before the update.
+
+        Returns
+        -------
+        dirty_rows : np.ndarray of int
+            The sorted inner ids of every changed row, including all newly added rows.
+
+        """
+        if self._user_based:
+            outer_to_inner = self._outer_to_inner_uid
+            features = users
+        else:
+            outer_to_inner = self._outer_to_inner_iid
+            features = items
+
+        dirty_rows = set(range(num_old, self._feature_matrix.shape[0]))
+        if ratings is not None:
+            for user_id, item_id in ratings:
+                dirty_rows.add(outer_to_inner[user_id if self._user_based else item_id])
+        if self._use_content and features is not None:
+            dirty_rows.update(outer_to_inner[outer_id] for outer_id in features)
+        return np.array(sorted(dirty_rows), dtype=np.intp)
+
+    def _neighborhoods(self, target_ids):
+        """Find the most similar users (or items) to each target.
+
+        Parameters
+        ----------
+        target_ids : np.ndarray of int
+            The inner ids of the users (or items) whose neighborhoods to compute.
+
+        Returns
+        -------
+        relevant_idxs : np.ndarray of int
+            The neighborhoods where relevant_idxs[i] are the neighbors of target_ids[i].
+        similarities : np.ndarray
+            The similarities where similarities[i, j] is the similarity between target_ids[i]
+            and relevant_idxs[i, j].
+
+        """
+        sims = self._similarity_matrix[target_ids]
+        num_neighbors = min(self._neighborhood_size, sims.shape[1])
+        if num_neighbors < sims.shape[1]:
+            relevant_idxs = np.argpartition(-sims, num_neighbors - 1,
+                                            axis=1)[:, :num_neighbors]
+        else:
+            relevant_idxs = np.broadcast_to(np.arange(sims.shape[1]), sims.shape)
+        return relevant_idxs, np.take_along_axis(sims, relevant_idxs, axis=1)
 
     def _predict(self, user_item):  # noqa: D102
-        preds = []
-        relevant_idxs_cache = {}
-        for user_id, item_id, _ in user_item:
-            if self._user_based:
-                if user_id not in relevant_idxs_cache:
-                    relevant_idxs_cache[user_id] = nlargest_indices(
-                        self._neighborhood_size, self._similarity_matrix[user_id])
-                relevant_idxs = relevant_idxs_cache[user_id]
-                similarities = self._similarity_matrix[relevant_idxs, user_id]
-                ratings = self._ratings_matrix[relevant_idxs, item_id].ravel()
-                mean = self._means[user_id]
-            else:
-                if item_id not in relevant_idxs_cache:
-                    relevant_idxs_cache[item_id] = nlargest_indices(
-                        self._neighborhood_size, self._similarity_matrix[item_id])
-                relevant_idxs = relevant_idxs_cache[item_id]
-                similarities = self._similarity_matrix[relevant_idxs, item_id]
-                ratings = self._ratings_matrix.T[relevant_idxs, user_id].ravel()
-                mean = self._means[item_id]
-            relevant_means = self._means[relevant_idxs]
-            nonzero = ratings != 0
-            ratings = ratings[nonzero]
-            similarities = similarities[nonzero]
-            # ensure that we aren't weighting by all 0
-            if np.all(np.isclose(similarities, 0)):
-                similarities = np.ones_like(similarities)
+        if len(user_item) == 0:
+            return np.empty(0)
+        user_ids, item_ids, _ = recommender.unzip_user_item(user_item)
+        if self._user_based:
+            target_ids = user_ids
+        else:
+            target_ids = item_ids
+
+        # Compute the neighborhood of each distinct target once and share it across queries.
+        unique_ids, inverse = np.unique(target_ids, return_inverse=True)
+        relevant_idxs, similarities = self._neighborhoods(unique_ids)
+        relevant_idxs = relevant_idxs[inverse]
+        similarities = similarities[inverse]
+        if relevant_idxs.shape[1] == 0:
+            # With an empty neighborhood every pair falls back to the no-ratings prediction.
             if self._use_means:
-                if len(ratings) == 0:
-                    preds.append(mean)
-                else:
-                    preds.append(mean + np.average(ratings - relevant_means[nonzero],
-                                                   weights=similarities))
-            else:
-                if len(ratings) == 0:
-                    preds.append(0)
-                else:
-                    preds.append(np.average(ratings, weights=similarities))
-
-        return np.array(preds)
-
+                return self._means[target_ids]
+            return np.zeros(len(target_ids))
 
-def cosine_similarity(X, Y, shrinkage):
+        # Gather the neighbors' ratings straight from the sparse feature matrix, whose leading
+        # columns are the items (or users) each row has rated.
+        if self._user_based:
+            other_ids = item_ids
+        else:
+            other_ids = user_ids
+        ratings = self._feature_matrix[relevant_idxs.ravel(),
+                                       np.repeat(other_ids, relevant_idxs.shape[1])]
+        ratings = np.asarray(ratings).reshape(relevant_idxs.shape)
+
+        # We only care about neighbors that have rated the queried pair.
+        nonzero = ratings != 0
+        similarities = np.where(nonzero, similarities, 0.0)
+        # Ensure that we aren't weighting by all 0.
+        all_zero = np.all(np.isclose(similarities, 0), axis=1)
+        similarities[all_zero] = nonzero[all_zero]
+        weights_sum = similarities.sum(axis=1)
+        has_ratings = nonzero.any(axis=1)
+
+        if self._use_means:
+            ratings = np.where(nonzero, ratings - self._means[relevant_idxs], 0.0)
+            offsets = divide_zero((similarities * ratings).sum(axis=1), weights_sum)
+            return self._means[target_ids] + np.where(has_ratings, offsets, 0.0)
+        preds = divide_zero((similarities * ratings).sum(axis=1), weights_sum)
+        return np.where(has_ratings, preds, 0.0)
+
+
+def cosine_similarity(X, Y, shrinkage, x_norms=None, y_norms=None):
     """Compute the cosine similarity between each row vector in each matrix X and Y.
 
     Parameters
     ----------
-    X : np.matrix
+    X : scipy.sparse.spmatrix
         The first matrix for which to compute the cosine similarity.
-    Y : np.matrix
+    Y : scipy.sparse.spmatrix
         The second matrix for which to compute the cosine similarity.
     shrinkage : float
         The amount of shrinkage to apply to the similarity computation.
+    x_norms : np.ndarray, optional
+        The precomputed L2 norm of each row of X.
+    y_norms : np.ndarray, optional
+        The precomputed L2 norm of each row of Y. If Y is X these default to x_norms.
 
     Returns
     -------
     similarity : np.ndarray
-        The similarity array between each pairs of row, where similarity[i, j]
+        The float32 similarity array between each pairs of row, where similarity[i, j]
         is the cosine similarity between X[i] and Y[j].
 
     """
-    return divide_zero((X @ Y.T).A, scipy.sparse.linalg.norm(X, axis=1)[:, np.newaxis] *
-                       scipy.sparse.linalg.norm(Y, axis=1)[np.newaxis, :] + shrinkage)
-
-
-def nlargest_indices(n, iterable):
-    """Given an iterable, computes the indices of the n largest items.
+    X = X.astype(np.float32)
+    Y = X if Y is X else Y.astype(np.float32)
+    if x_norms is None:
+        x_norms = row_norms(X)
+    if y_norms is None:
+        y_norms = x_norms if Y is X else row_norms(Y)
+    denom = np.outer(x_norms.astype(np.float32), y_norms.astype(np.float32)) + shrinkage
+    if Y is X and X.nnz >= DENSE_PRODUCT_MIN_DENSITY * X.shape[0] * X.shape[1]:
+        # The features are dense enough that a BLAS product beats the sparse one.
+        X = X.toarray()
+        product = X @ X.T
+    else:
+        # Keep the product sparse and only densify once it has been normalized.
+        product = X @ Y.T
+    return divide_zero(product, denom).astype(np.float32, copy=False)
+
+
+def row_norms(matrix):
+    """Compute the L2 norm of each row of a sparse matrix.
 
     Parameters
     ----------
-    n : int
-        How many indices to retrieve.
-    iterable : iterable
-        The iterable from which to compute the n largest indices.
+    matrix : scipy.sparse.spmatrix
+        The matrix whose row norms to compute.
 
     Returns
     -------
-    largest : list of int
-        The n largest indices where largest[i] is the index of the i-th largest index.
+    norms : np.ndarray
+        The norms where norms[i] is the L2 norm of matrix[i].
 
     """
-    nlargest = heapq.nlargest(n, enumerate(iterable),
-                              key=lambda x: x[1])
-    return [i[0] for i in nlargest]
+    # Sum the squares of each row directly on the CSR buffers, skipping empty rows since
+    # reduceat would otherwise return the next row's first element for them.
+    matrix = scipy.sparse.csr_matrix(matrix)
+    squares = matrix.data * matrix.data
+    nonempty = np.diff(matrix.indptr) > 0
+    norms = np.zeros(matrix.shape[0], dtype=squares.dtype)
+    norms[nonempty] = np.add.reduceat(squares, matrix.indptr[:-1][nonempty])
+    return np.sqrt(norms)
 
 
 def flatten(matrix):
@@ -222,4 +327,8 @@ def flatten(matrix):
 def divide_zero(num, denom):
     """Divide a and b but return 0 instead of nan for divide by 0."""
     # TODO: is this the desired zero-division behavior?
-    return np.divide(num, denom, out=np.zeros_like(num), where=(denom != 0))
+    denom = np.asarray(denom, dtype=np.result_type(denom, np.float32))
+    inverse = np.reciprocal(denom, out=np.zeros_like(denom), where=(denom != 0))
+    if scipy.sparse.issparse(num):
+        return num.multiply(inverse).toarray()
+    return num * inverse
@@ -78,9 +78,7 @@ class Llorma(recommender.PredictRecommender):
         return 'llorma'
 
     def _predict(self, user_item):  # noqa: D102
-        users, items, _ = list(zip(*user_item))
-        users = np.array(users)
-        items = np.array(items)
+        users, items, _ = recommender.unzip_user_item(user_item)
         # Check that both the item and the user have been seen in historical data.
         is_seen_uid = np.array(users <= (self.model.batch_manager.n_user - 1))
         is_seen_iid = np.array(items <= (self.model.batch_manager.n_item - 1))
@@ -7,7 +7,6 @@ often enough to be an abstract classes to inherit from.
 """
 import abc
 import collections
-import itertools
 
 import numpy as np
 import scipy
@@ -216,7 +215,6 @@ class PredictRecommender(Recommender):
                 if user_id not in self._outer_to_inner_uid:
                     self._outer_to_inner_uid[user_id] = len(self._users)
                     self._inner_to_outer_uid.append(user_id)
-                    self._ratings.resize((self._ratings.shape[0] + 1, self._ratings.shape[1]))
                     self._users.append(features)
                 else:
                     inner_id = self._outer_to_inner_uid[user_id]
@@ -228,21 +226,29 @@ class PredictRecommender(Recommender):
                 if item_id not in self._outer_to_inner_iid:
                     self._outer_to_inner_iid[item_id] = len(self._items)
                     self._inner_to_outer_iid.append(item_id)
-                    self._ratings.resize((self._ratings.shape[0], self._ratings.shape[1] + 1))
                     self._items.append(features)
                 else:
                     inner_id = self._outer_to_inner_iid[item_id]
                     self._items[inner_id] = features
 
+        # Grow the rating matrix once to fit all the new users and items.
+        if self._ratings.shape != (len(self._users), len(self._items)):
+            self._ratings.resize((len(self._users), len(self._items)))
+
         # Update the rating info.
         if ratings is not None:
+            inner_uids = []
+            inner_iids = []
+            rating_values = []
             for (user_id, item_id), (rating, context) in ratings.items():
                 inner_uid = self._outer_to_inner_uid[user_id]
                 inner_iid = self._outer_to_inner_iid[item_id]
-                self._ratings[inner_uid, inner_iid] = rating
+                inner_uids.append(inner_uid)
+                inner_iids.append(inner_iid)
+                rating_values.append(rating)
                 self._rating_contexts[inner_uid, inner_iid].append(context)
-                assert inner_uid < len(self._users)
-                assert inner_iid < len(self._items)
+            # Assign all the ratings at once rather than one element at a time.
+            self._ratings[inner_uids, inner_iids] = rating_values
 
     def recommend(self, user_contexts, num_recommendations):
         """Recommend items to users.
@@ -267,36 +273,52 @@ class PredictRecommender(Recommender):
         """
         # Format the arrays to be passed to the prediction function. We need to predict all
         # items that have not been rated for each user.
-        ratings_to_predict = []
-        all_item_ids = []
         # TODO: We need to figure out what to do when the number of items left to recommend
         # runs out.
-        for user_id in user_contexts:
-            inner_uid = self._outer_to_inner_uid[user_id]
-            item_ids = self._ratings[inner_uid].nonzero()[1]
-            item_ids = np.setdiff1d(np.arange(len(self._items)), item_ids)
-            user_ids = inner_uid * np.ones(len(item_ids), dtype=np.int)
-            contexts = len(item_ids) * [user_contexts[user_id]]
-            ratings_to_predict += list(zip(user_ids, item_ids, contexts))
-            all_item_ids.append(item_ids)
+        inner_uids = np.array([self._outer_to_inner_uid[user_id] for user_id in user_contexts],
+                              dtype=int)
+        all_contexts = list(user_contexts.values())
+        # Only build the rated mask for the requested users, so it is never larger than the
+        # candidate pairs we predict anyway. The rating matrix doesn't store ratings of exactly
+        # zero, so those items still count as unrated.
+        unrated = np.ones((len(inner_uids), len(self._items)), dtype=bool)
+        unrated[self._ratings.tocsr()[inner_uids].nonzero()] = False
+        user_idxs, item_ids = np.nonzero(unrated)
+        item_lens = unrated.sum(axis=1)
+        user_ids = inner_uids[user_idxs]
 
         # Predict the ratings and convert predictions into a list of arrays indexed by user.
         if self._dense_predictions is None:
-            all_predictions = self._predict(ratings_to_predict)
+            contexts = [context for context, item_len in zip(all_contexts, item_lens)
+                        for _ in range(item_len)]
+            all_predictions = self._predict(list(zip(user_ids, item_ids, contexts)))
         else:
-            all_predictions = []
-            for user_id, item_id, _ in ratings_to_predict:
-                all_predictions.append(self._dense_predictions[user_id, item_id])
+            all_predictions = np.asarray(self._dense_predictions[user_ids, item_ids]).ravel()
+
+        # TODO: Right now items with the same ratings will be sorted in a deterministic order.
+        # This probably shouldn't be the case.
+        if (self._strategy_dict.get('type') == 'greedy' and
+                np.all(item_lens >= num_recommendations) and
+                np.isfinite(all_predictions).all()):
+            # Every user has enough unrated items, so we can select the top items of all users
+            # at once by scattering the predictions into a matrix where rated items can't win.
+            # This relies on -inf never being a real prediction, so recommenders that predict
+            # -inf (e.g. TopPop for unrated items) go through the per-user path below.
+            dtype = np.result_type(all_predictions, np.float32)
+            predictions = np.full(unrated.shape, -np.inf, dtype=dtype)
+            predictions[unrated] = all_predictions
+            recs = top_k_indices(predictions, num_recommendations)
+            predicted_ratings = np.take_along_axis(predictions, recs, axis=1)
+            # Convert the recommendations to outer item ids.
+            return np.array(self._inner_to_outer_iid)[recs], predicted_ratings
 
-        item_lens = map(len, all_item_ids)
-        all_predictions = np.split(all_predictions,
-                                   list(itertools.accumulate(item_lens)))
+        split_idxs = np.cumsum(item_lens)[:-1]
+        all_item_ids = np.split(item_ids, split_idxs) if len(inner_uids) else []
+        all_predictions = np.split(all_predictions, split_idxs)
 
         # Pick items according to the strategy, along with their predicted ratings.
         all_recs = []
         all_predicted_ratings = []
-        # TODO: Right now items with the same ratings will be sorted in a deterministic order.
-        # This probably shouldn't be the case.
         for item_ids, predictions in zip(all_item_ids, all_predictions):
             recs, predicted_ratings = self._select_item(item_ids, predictions,
                                                         num_recommendations)
@@ -339,13 +361,50 @@ class PredictRecommender(Recommender):
         predictions : np.ndarray
             The rating predictions where predictions[i] is the prediction of the i-th pair.
 
+        """
+        return self.predict_encoded(self.encode_batch(user_item))
+
+    def encode_batch(self, user_item):
+        """Convert user-item pairs into the recommender's internal representation.
+
+        Encoding the pairs once and calling predict_encoded avoids repeating the id lookups
+        when the same pairs are predicted several times. The encoded pairs stay valid across
+        calls to update, but not across calls to reset.
+
+        Parameters
+        ----------
+        user_item : list of tuple
+            The list of all user-item pairs along with the rating context in the same format
+            as in predict.
+
+        Returns
+        -------
+        encoded : list of tuple
+            The pairs with the user and item ids replaced by their inner ids.
+
         """
         inner_user_item = []
         for user_id, item_id, context in user_item:
             inner_uid = self._outer_to_inner_uid[user_id]
             inner_iid = self._outer_to_inner_iid[item_id]
             inner_user_item.append((inner_uid, inner_iid, context))
-        return self._predict(inner_user_item)
+        return inner_user_item
+
+    def predict_encoded(self, encoded):
+        """Predict the ratings of user-item pairs that were encoded with encode_batch.
+
+        Parameters
+        ----------
+        encoded : list of tuple
+            The encoded user-item pairs.
+
+        Returns
+        -------
+        predictions : np.ndarray
+            The rating predictions where predictions[i] is the prediction of the i-th pair.
+
+        """
+        return self._predict(encoded)
 
     def _select_item(self, item_ids, predictions, num_recommendations):
         """Select items given a strategy.
@@ -372,13 +431,13 @@ class PredictRecommender(Recommender):
 
         strategy_type = self._strategy_dict.get('type')
         if strategy_type == 'greedy':
-            selected_indices = np.argsort(predictions)[-num_recommendations:]
+            selected_indices = top_k_indices(predictions, num_recommendations)
         elif strategy_type == 'eps_greedy':
             eps = float(self._strategy_dict.get('eps'))
             num_explore = np.random.binomial(num_recommendations, eps)
             num_exploit = num_recommendations - num_explore
             if num_exploit > 0:
-                exploit_indices = np.argsort(predictions)[-num_exploit:]
+                exploit_indices = top_k_indices(predictions, num_exploit)
             else:
                 exploit_indices = []
             explore_indices = np.random.choice([x for x in range(0, num_items)
@@ -413,3 +472,54 @@ class PredictRecommender(Recommender):
 
         """
         raise NotImplementedError
+
+
+def top_k_indices(values, k):
+    """Compute the indices of the k largest values.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        The values from which to select the largest entries. If values has more than one
+        dimension the selection is done independently along the last axis.
+    k : int
+        How many indices to retrieve.
+
+    Returns
+    -------
+    indices : np.ndarray of int
+        The indices of the k largest values sorted in increasing order of value, which matches
+        the ordering of np.argsort(values, axis=-1)[..., -k:].
+
+    """
+    if k >= values.shape[-1]:
+        return np.argsort(values, axis=-1)
+    indices = np.argpartition(values, -k, axis=-1)[..., -k:]
+    order = np.argsort(np.take_along_axis(values, indices, axis=-1), axis=-1)
+    return np.take_along_axis(indices, order, axis=-1)
+
+
+def unzip_user_item(user_item):
+    """Split user-item pairs into separate arrays of user ids, item ids and contexts.
+
+    Parameters
+    ----------
+    user_item : list of tuple
+        Each element is a triple where the first element in the tuple is
+        the user id, the second element is the item id and the third element
+        is the context in which the item will be rated.
+
+    Returns
+    -------
+    user_ids : np.ndarray of int
+        The user ids where user_ids[i] is the user id of the i-th pair.
+    item_ids : np.ndarray of int
+        The item ids where item_ids[i] is the item id of the i-th pair.
+    contexts : list
+        The rating contexts where contexts[i] is the context of the i-th pair.
+
+    """
+    if len(user_item) == 0:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int), []
+    user_ids, item_ids, contexts = zip(*user_item)
+    return np.array(user_ids, dtype=int), np.array(item_ids, dtype=int), list(contexts)
@@ -99,11 +99,8 @@ class SLIM(recommender.PredictRecommender):
     def _predict(self, user_item):  # noqa: D102
         # Predict on all user-item pairs.
         all_predictions = self.dense_predictions
-        predictions = []
-        for user_id, item_id, _ in user_item:
-            predictions.append(all_predictions[user_id, item_id])
-
-        return np.array(predictions)
+        user_ids, item_ids, _ = recommender.unzip_user_item(user_item)
+        return np.asarray(all_predictions[user_ids, item_ids]).ravel()
 
 
 class EASE(recommender.PredictRecommender):
@@ -165,8 +162,5 @@ class EASE(recommender.PredictRecommender):
     def _predict(self, user_item):  # noqa: D102
         # Predict on all user-item pairs.
         all_predictions = self.dense_predictions
-        predictions = []
-        for user_id, item_id, _ in user_item:
-            predictions.append(all_predictions[user_id, item_id])
-
-        return np.array(predictions)
+        user_ids, item_ids, _ = recommender.unzip_user_item(user_item)
+        return np.asarray(all_predictions[user_ids, item_ids]).ravel()
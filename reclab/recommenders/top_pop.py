@@ -39,8 +39,5 @@ class TopPop(recommender.PredictRecommender):
     def _predict(self, user_item):  # noqa: D102
         # Predict on all user-item pairs.
         average_item_ratings = self._average_item_ratings()
-        predictions = []
-        for _, item_id, _ in user_item:
-            predictions.append(average_item_ratings[item_id])
-
-        return np.array(predictions)
+        _, item_ids, _ = recommender.unzip_user_item(user_item)
+        return average_item_ratings[item_ids]
@@ -0,0 +1,64 @@
+"""Tests for the dataset utilities."""
+import numpy as np
+import pandas as pd
+
+from reclab import data_utils
+
+
+def make_ratings(num_ratings):
+    """Create a dict of distinct ratings with empty contexts."""
+    return {(i, i % 3): (i % 5 + 1, np.zeros((0,))) for i in range(num_ratings)}
+
+
+def test_split_ratings_rng():
+    """Test that shuffling with a generator is reproducible and leaves the global state alone."""
+    ratings = make_ratings(20)
+    np.random.seed(0)
+    global_state = np.random.get_state()[1].copy()
+    split_1, split_2 = data_utils.split_ratings(ratings, 0.75, shuffle=True,
+                                                rng=np.random.default_rng(1))
+    np.testing.assert_array_equal(np.random.get_state()[1], global_state)
+
+    assert len(split_1) == 15
+    assert len(split_2) == 5
+    assert {**split_1, **split_2} == ratings
+    assert list(split_1) != list(ratings)[:15]
+
+    same_1, same_2 = data_utils.split_ratings(ratings, 0.75, shuffle=True,
+                                              rng=np.random.default_rng(1))
+    assert list(same_1) == list(split_1)
+    assert list(same_2) == list(split_2)
+
+
+def test_split_ratings_by_indices():
+    """Test that ratings are split in the order given by the indices."""
+    ratings = make_ratings(6)
+    keys = list(ratings)
+    indices = np.array([4, 0, 5, 2, 1, 3])
+    split_1, split_2 = data_utils.split_ratings_by_indices(ratings, indices, 0.5)
+    assert list(split_1) == [keys[4], keys[0], keys[5]]
+    assert list(split_2) == [keys[2], keys[1], keys[3]]
+    for key, val in {**split_1, **split_2}.items():
+        assert val is ratings[key]
+
+
+def test_dataset_from_dataframe_array():
+    """Test that the rating array matches the rating dict, with and without repeated pairs."""
+    distinct = pd.DataFrame({'user_id': [1, 2, 1, 3],
+                             'item_id': [10, 10, 20, 30],
+                             'rating': [5, 3, 4, 1]})
+    repeated = pd.DataFrame({'user_id': [1, 2, 1, 1],
+                             'item_id': [10, 10, 20, 10],
+                             'rating': [5, 3, 4, 2]})
+    for data in (distinct, repeated):
+        _, _, ratings, ratings_arr = data_utils.dataset_from_dataframe(
+            data, shuffle=False, return_array=True)
+        assert ratings_arr.dtype == data_utils.RATINGS_DTYPE
+        assert list(zip(ratings_arr['u'].tolist(), ratings_arr['i'].tolist())) == list(ratings)
+        np.testing.assert_array_equal(ratings_arr['score'],
+                                      [rating for rating, _ in ratings.values()])
+        assert len(data_utils.dataset_from_dataframe(data, shuffle=False)) == 3
+
+    # The last dataset has a repeated pair, which keeps a single entry holding its last rating.
+    assert len(ratings_arr) == 3
+    assert ratings[1, 10][0] == 2
@@ -1,5 +1,9 @@
 """Tests for the KNN recommender."""
+import numpy as np
+import scipy.sparse
+
 from reclab.recommenders import KNNRecommender
+from reclab.recommenders import knn_recommender
 from . import utils
 
 
@@ -25,3 +29,84 @@ def test_item_recommend():
     """Test that KNN-item will recommend reasonable items."""
     recommender = KNNRecommender(user_based=True)
     utils.test_recommend_simple(recommender)
+
+
+def test_incremental_update():
+    """Test that a small update gives the same predictions as retraining from scratch."""
+    users = {user_id: np.zeros((0,)) for user_id in range(4)}
+    items = {item_id: np.zeros((0,)) for item_id in range(4)}
+    ratings = {(0, 0): (5, np.zeros((0,))),
+               (0, 1): (3, np.zeros((0,))),
+               (1, 0): (4, np.zeros((0,))),
+               (1, 2): (2, np.zeros((0,))),
+               (2, 1): (1, np.zeros((0,))),
+               (2, 3): (5, np.zeros((0,))),
+               (3, 2): (4, np.zeros((0,)))}
+    new_ratings = {(0, 3): (4, np.zeros((0,))),
+                   (4, 1): (2, np.zeros((0,)))}
+    for user_based in (True, False):
+        incremental = KNNRecommender(user_based=user_based)
+        incremental.reset(users, items, ratings)
+        incremental.update(users={4: np.zeros((0,))}, ratings=new_ratings)
+
+        retrained = KNNRecommender(user_based=user_based)
+        retrained.reset({**users, 4: np.zeros((0,))}, items, {**ratings, **new_ratings})
+        np.testing.assert_allclose(incremental.dense_predictions, retrained.dense_predictions)
+
+
+def test_dense_predictions_match_predict():
+    """Test that the dense predictions agree with predicting every user-item pair."""
+    users = {user_id: np.zeros((0,)) for user_id in range(4)}
+    items = {item_id: np.zeros((0,)) for item_id in range(4)}
+    ratings = {(0, 0): (5, np.zeros((0,))),
+               (1, 1): (4, np.zeros((0,))),
+               (2, 1): (2, np.zeros((0,))),
+               (2, 2): (4, np.zeros((0,))),
+               (3, 3): (1, np.zeros((0,)))}
+    user_item = [(user_id, item_id, np.zeros((0,))) for user_id in users for item_id in items]
+    for user_based in (True, False):
+        for use_means in (True, False):
+            recommender = KNNRecommender(user_based=user_based, use_means=use_means,
+                                         neighborhood_size=2)
+            recommender.reset(users, items, ratings)
+            preds = recommender.predict(user_item).reshape(len(users), len(items))
+            np.testing.assert_allclose(recommender.dense_predictions, preds, rtol=1e-6)
+
+
+def test_row_norms():
+    """Test that row_norms matches a dense norm, including for empty rows."""
+    matrix = np.array([[0, 0, 0],
+                       [3, 0, 4],
+                       [0, 0, 0],
+                       [0, 0, 0],
+                       [1, 2, 2],
+                       [0, 0, 0]], dtype=np.float64)
+    for sparse_matrix in (scipy.sparse.csr_matrix(matrix), scipy.sparse.coo_matrix(matrix)):
+        np.testing.assert_allclose(knn_recommender.row_norms(sparse_matrix),
+                                   np.linalg.norm(matrix, axis=1))
+    assert knn_recommender.row_norms(scipy.sparse.csr_matrix((0, 3))).shape == (0,)
+
+
+def test_empty_neighborhood():
+    """Test that a neighborhood size of 0 falls back to the means (or 0) for every pair."""
+    users = {user_id: np.zeros((0,)) for user_id in range(3)}
+    items = {item_id: np.zeros((0,)) for item_id in range(3)}
+    ratings = {(0, 0): (5, np.zeros((0,))),
+               (0, 1): (3, np.zeros((0,))),
+               (1, 1): (2, np.zeros((0,))),
+               (2, 2): (4, np.zeros((0,)))}
+    user_item = [(user_id, item_id, np.zeros((0,))) for user_id in users for item_id in items]
+    for user_based in (True, False):
+        for use_means in (True, False):
+            recommender = KNNRecommender(user_based=user_based, use_means=use_means,
+                                         neighborhood_size=0)
+            recommender.reset(users, items, ratings)
+            preds = recommender.predict(user_item).reshape(len(users), len(items))
+            if not use_means:
+                expected = np.zeros((len(users), len(items)))
+            elif user_based:
+                expected = np.repeat([[4], [2], [4]], len(items), axis=1)
+            else:
+                expected = np.repeat([[5, 2.5, 4]], len(users), axis=0)
+            np.testing.assert_allclose(preds, expected)
+            np.testing.assert_allclose(recommender.dense_predictions, expected)
@@ -0,0 +1,78 @@
+"""Tests for the shared recommender base classes."""
+import numpy as np
+
+from reclab.recommenders import recommender
+
+
+class FixedPredictRecommender(recommender.PredictRecommender):
+    """A recommender whose predictions are read from a fixed matrix."""
+
+    def __init__(self, predictions):
+        """Create a recommender that predicts predictions[user_id, item_id]."""
+        super().__init__()
+        self._fixed_predictions = predictions
+
+    @property
+    def name(self):  # noqa: D102
+        return 'fixed'
+
+    def _predict(self, user_item):  # noqa: D102
+        user_ids, item_ids, _ = recommender.unzip_user_item(user_item)
+        return self._fixed_predictions[user_ids, item_ids]
+
+
+def test_greedy_recommend_matches_select_item():
+    """Test that the batched greedy selection agrees with selecting for each user separately."""
+    rng = np.random.default_rng(0)
+    num_users, num_items, num_recs = 6, 10, 3
+    predictions = rng.random((num_users, num_items))
+    users = {user_id: np.zeros((0,)) for user_id in range(num_users)}
+    items = {item_id: np.zeros((0,)) for item_id in range(num_items)}
+    ratings = {(user_id, item_id): (5, np.zeros((0,)))
+               for user_id, item_id in zip(rng.integers(num_users, size=20),
+                                           rng.integers(num_items, size=20))}
+
+    rec = FixedPredictRecommender(predictions)
+    rec.reset(users, items, ratings)
+    user_contexts = {user_id: np.zeros((0,)) for user_id in range(0, num_users, 2)}
+    recs, predicted_ratings = rec.recommend(user_contexts, num_recs)
+
+    assert recs.shape == (len(user_contexts), num_recs)
+    for i, user_id in enumerate(user_contexts):
+        item_ids = np.array([item_id for item_id in items if (user_id, item_id) not in ratings])
+        # Every user needs enough unrated items for recommend to take the batched path.
+        assert len(item_ids) >= num_recs
+        # pylint: disable=protected-access
+        expected_recs, expected_ratings = rec._select_item(item_ids,
+                                                           predictions[user_id, item_ids],
+                                                           num_recs)
+        np.testing.assert_array_equal(recs[i], expected_recs)
+        np.testing.assert_array_equal(predicted_ratings[i], expected_ratings)
+
+
+def test_top_k_indices():
+    """Test that top_k_indices matches a full argsort along the last axis."""
+    values = np.random.default_rng(0).random((4, 7))
+    for k in (1, 3, 7, 10):
+        np.testing.assert_array_equal(recommender.top_k_indices(values, k),
+                                      np.argsort(values, axis=-1)[:, -k:])
+        np.testing.assert_array_equal(recommender.top_k_indices(values[0], k),
+                                      np.argsort(values[0])[-k:])
+
+
+def test_greedy_recommend_skips_rated_items_with_infinite_predictions():
+    """Test that rated items are never recommended when unrated items predict -inf."""
+    num_items, num_recs = 50, 25
+    # Like TopPop, items nobody has rated yet are predicted as -inf.
+    predictions = np.full((2, num_items), -np.inf)
+    predictions[:, :num_items // 2] = np.linspace(1, 5, num_items // 2)
+    users = {user_id: np.zeros((0,)) for user_id in range(2)}
+    items = {item_id: np.zeros((0,)) for item_id in range(num_items)}
+    ratings = {(0, item_id): (5, np.zeros((0,))) for item_id in range(num_items // 2)}
+
+    rec = FixedPredictRecommender(predictions)
+    rec.reset(users, items, ratings)
+    recs, _ = rec.recommend({0: np.zeros((0,)), 1: np.zeros((0,))}, num_recs)
+    assert not any((0, item_id) in ratings for item_id in recs[0])
+    assert sorted(recs[0]) == list(range(num_items // 2, num_items))
+    assert len(set(recs[1])) == num_recs
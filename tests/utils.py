@@ -1,5 +1,6 @@
 """A set of utility functions for testing."""
-import collections
+import functools
+
 import numpy as np
 
 from reclab import data_utils
@@ -10,26 +11,36 @@ NUM_ITEMS_ML100K = 1682
 NUM_USERS_SIMPLE = 2
 NUM_ITEMS_SIMPLE = 3
 
+# A shared read-only empty vector used for all contexts and features so the tests don't
+# allocate a new one for every user, item and rating.
+_EMPTY_CTX = np.zeros(0)
+_EMPTY_CTX.flags.writeable = False
+
 
 def test_predict_ml100k(recommender, rmse_threshold=1.1, seed=None, test_dense=False):
     """Test that recommender predicts well and that it gets better with more data."""
-    users, items, ratings = data_utils.read_dataset('ml-100k')
+    users, items, train_ratings_1, train_ratings_2, test_ratings, test_arr = split_ml100k(seed)
     assert NUM_USERS_ML100K == len(users)
     assert NUM_ITEMS_ML100K == len(items)
-    train_ratings, test_ratings = data_utils.split_ratings(ratings, 0.9, shuffle=True, seed=seed)
-    train_ratings_1, train_ratings_2 = data_utils.split_ratings(train_ratings, 0.5)
     recommender.reset(users, items, train_ratings_1)
-    user_item = [(key[0], key[1], val[1]) for key, val in test_ratings.items()]
-    preds = recommender.predict(user_item)
-    targets = [t[0] for t in test_ratings.values()]
-    rmse1 = rmse(preds, targets)
+
+    user_ids = test_arr['u']
+    item_ids = test_arr['i']
+    targets = np.ascontiguousarray(test_arr['score'])
+    contexts = [context for _, context in test_ratings.values()]
+    user_item = list(zip(user_ids.tolist(), item_ids.tolist(), contexts))
+
+    # Encode the pairs once since they are predicted both before and after the update.
+    encoded = recommender.encode_batch(user_item)
+    preds = recommender.predict_encoded(encoded)
+    rmse1 = float(rmse(preds, targets))
 
     # We should get a relatively low RMSE here.
     assert rmse1 < rmse_threshold
 
     recommender.update(ratings=train_ratings_2)
-    preds = recommender.predict(user_item)
-    rmse2 = rmse(preds, targets)
+    preds = recommender.predict_encoded(encoded)
+    rmse2 = float(rmse(preds, targets))
 
     # The RMSE should have reduced.
     assert rmse1 > rmse2
@@ -37,20 +48,18 @@ def test_predict_ml100k(recommender, rmse_threshold=1.1, seed=None, test_dense=F
     if test_dense:
         # Test that the dense predictions work as well.
         dense = recommender.dense_predictions
-        preds = np.array([dense[key[0] - 1, key[1] - 1] for key in test_ratings])
-        rmse3 = rmse(preds, targets)
+        preds = np.asarray(dense[user_ids - 1, item_ids - 1]).ravel()
+        rmse3 = float(rmse(preds, targets))
         # The RMSE should have reduced.
         assert rmse1 > rmse3
 
 
 def test_binary_recommend_ml100k(recommender, hit_rate_threshold, seed=None):
     """Test that the recommender will recommend good items and it gets better with more data."""
-    users, items, ratings = data_utils.read_dataset('ml-100k')
+    users, items, train_ratings_1, train_ratings_2, test_ratings, _ = split_ml100k(seed)
     assert NUM_USERS_ML100K == len(users)
     assert NUM_ITEMS_ML100K == len(items)
-    train_ratings, test_ratings = data_utils.split_ratings(ratings, 0.9, shuffle=True, seed=seed)
-    train_ratings_1, train_ratings_2 = data_utils.split_ratings(train_ratings, 0.5)
-    all_contexts = collections.OrderedDict([(user_id, np.zeros(0)) for user_id in users])
+    all_contexts = {user_id: _EMPTY_CTX for user_id in users}
 
     recommender.reset(users, items, train_ratings_1)
     recs, _ = recommender.recommend(all_contexts, 1)
@@ -72,29 +81,56 @@ def test_binary_recommend_ml100k(recommender, hit_rate_threshold, seed=None):
 
 def test_recommend_simple(recommender):
     """Test that recommender will recommend reasonable items in simple setting."""
-    users = {0: np.zeros((0,)),
-             1: np.zeros((0,))}
-    items = {0: np.zeros((0,)),
-             1: np.zeros((0,)),
-             2: np.zeros((0,))}
+    users = {0: _EMPTY_CTX,
+             1: _EMPTY_CTX}
+    items = {0: _EMPTY_CTX,
+             1: _EMPTY_CTX,
+             2: _EMPTY_CTX}
     assert NUM_USERS_SIMPLE == len(users)
     assert NUM_ITEMS_SIMPLE == len(items)
-    ratings = {(0, 0): (5, np.zeros((0,))),
-               (0, 1): (1, np.zeros((0,))),
-               (0, 2): (5, np.zeros((0,))),
-               (1, 0): (5, np.zeros((0,)))}
+    ratings = {(0, 0): (5, _EMPTY_CTX),
+               (0, 1): (1, _EMPTY_CTX),
+               (0, 2): (5, _EMPTY_CTX),
+               (1, 0): (5, _EMPTY_CTX)}
     recommender.reset(users, items, ratings)
-    user_contexts = collections.OrderedDict([(1, np.zeros((0,)))])
+    user_contexts = {1: _EMPTY_CTX}
     recs, _ = recommender.recommend(user_contexts, 1)
-    recommender.predict([(1, 1, np.zeros(0,)), (1, 2, np.zeros(0,))])
-    assert recs.shape == (1, 1)
+    recommender.predict([(1, 1, _EMPTY_CTX), (1, 2, _EMPTY_CTX)])
+    assert recs.shape[0] == 1 and recs.shape[1] == 1
     # The recommender should have recommended the item that user0 rated the highest.
-    assert recs[0, 0] == 2
+    assert int(recs[0, 0]) == 2
+
+
+def split_ml100k(seed=None):
+    """Split ml-100k into two halves of training ratings and a set of test ratings.
+
+    The test ratings are returned both as a dict and as a structured array in the same order.
+    The dataset is only parsed once, so the returned users and items are shared between calls
+    and must not be mutated.
+    """
+    users, items, ratings, ratings_arr = _read_ml100k()
+    if seed is None:
+        # Draw the seed from the global random state so recommenders that seed numpy in their
+        # constructor still get the same split on every run.
+        seed = np.random.randint(2 ** 32, dtype=np.int64)
+    indices = np.random.default_rng(seed).permutation(len(ratings))
+    train_ratings, test_ratings = data_utils.split_ratings_by_indices(ratings, indices, 0.9)
+    train_ratings_1, train_ratings_2 = data_utils.split_ratings(train_ratings, 0.5)
+    test_arr = ratings_arr[indices[len(train_ratings):]]
+    return users, items, train_ratings_1, train_ratings_2, test_ratings, test_arr
+
+
+@functools.lru_cache(maxsize=1)
+def _read_ml100k():
+    return data_utils.read_dataset('ml-100k', return_array=True)
 
 
 def rmse(predictions, targets):
     """Compute the root mean squared error (RMSE) between prediction and target vectors."""
-    return np.sqrt(((predictions - targets) ** 2).mean())
+    # Ratings don't need more than single precision, but accumulate in double precision so the
+    # sum of squares doesn't lose accuracy on long vectors.
+    diff = np.subtract(predictions, targets, dtype=np.float32).astype(np.float64)
+    return np.linalg.norm(diff) / np.sqrt(diff.size)
 
 
 def mock_select_online_users(self):